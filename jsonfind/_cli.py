@@ -1,11 +1,13 @@
 from ._version import VERSION
 import sys
 import functools
+import itertools
 import click
 import json
 from logging import getLogger, basicConfig, INFO, DEBUG
-from .jsonfind import JsonFind, format_list, find_format_list, EQ, IS, IN1, IN2
+from .jsonfind import JsonFind, JsonIndex, format_list, find_format_list, compare_mode, EQ, IS, IN1, IN2
 from .jsonfind import compare_regexp, compare_regexp_substr, compare_eval, compare_fnmatch, compare_range
+from .jsonfind import compare_fuzzy
 
 log = getLogger(__name__)
 
@@ -129,12 +131,7 @@ compare_fn = {
     "eval": compare_eval,
     "fnmatch": compare_fnmatch,
     "range": compare_range,
-}
-
-filter_fn = {
-    "sub": JsonFind.filter_compare_subset,
-    "super": JsonFind.filter_compare_superset,
-    "set": JsonFind.filter_compare,
+    "fuzzy": compare_fuzzy,
 }
 
 
@@ -142,18 +139,58 @@ filter_fn = {
 @obj_option
 @click.option("--key", type=click.Choice(compare_fn.keys()), default="eq")
 @click.option("--value", type=click.Choice(compare_fn.keys()), default="eq")
-@click.option("--mode", type=click.Choice(filter_fn.keys()), default="set")
-def find_any(verbose, obj, target, format, key, value, mode):
+@click.option("--mode", type=click.Choice(compare_mode.keys()), default="set")
+@click.option("--explain/--no-explain", default=False, help="show query plan to stderr")
+def find_any(verbose, obj, target, format, key, value, mode, explain):
     log.debug("finding(regex val) %s from %s (key=%s, value=%s, mode=%s)",
               target, obj, key, value, mode)
     key_fn = compare_fn.get(key)
     val_fn = compare_fn.get(value)
-    cmpfn = filter_fn.get(mode)
+    # a one-shot query scans once; an index would cost a scan more to build
+    stats = JsonFind.node_stats(obj) if explain else None
+    plan = JsonFind.plan(target, key_fn, val_fn, mode, stats=stats)
     result = [JsonFind.format_to(format, x)
-              for x in cmpfn(obj, target, key_fn, val_fn)]
+              for x in JsonFind.filter_plan(obj, plan)]
     log.debug("result: %s", result)
+    if explain:
+        click.echo(json.dumps(plan.explain()), err=True)
     click.echo(json.dumps(result))
 
 
+@cli.command()
+@click.option("--verbose/--no-verbose", default=False)
+@click.option("--target", type=str, multiple=True, help="query string (repeatable)")
+@click.option("--target-file", type=click.File('r'), default=None, help="query strings, one per line")
+@click.option("--format", type=click.Choice(format_list), default="jsonpointer")
+@click.option("--distance", type=click.IntRange(min=0), default=None, help="max edit distance (default: 1)")
+@click.option("--similarity", type=click.FloatRange(0, 1), default=None, help="min trigram similarity (0.0-1.0)")
+@click.option("--keys/--no-keys", default=True, help="match object keys")
+@click.option("--values/--no-values", default=True, help="match string values")
+@click.option("--limit", type=click.IntRange(min=0), default=None, help="max number of results (per target)")
+@click.argument("obj", type=click.File('r'), default=sys.stdin)
+def find_fuzzy(verbose, target, target_file, format, distance, similarity, keys, values, limit, obj):
+    set_verbose(verbose)
+    targets = list(target)
+    if target_file is not None:
+        targets.extend(x.rstrip("\n") for x in target_file if x.strip())
+    if not targets:
+        raise click.UsageError("--target or --target-file is required")
+    obj = json.load(obj)
+    log.debug("finding(fuzzy) %s from %s (distance=%s, similarity=%s)",
+              targets, obj, distance, similarity)
+    # the index is built once and pays off from the second target
+    index = JsonIndex(obj) if len(targets) > 1 else None
+    result = {}
+    for t in targets:
+        result[t] = [JsonFind.format_to(format, x)
+                     for x in itertools.islice(
+                         JsonFind.filter_fuzzy(obj, t, distance, similarity, keys, values, index), limit)]
+    log.debug("result: %s", result)
+    if len(targets) == 1:
+        click.echo(json.dumps(result[targets[0]]))
+    else:
+        click.echo(json.dumps(result))
+
+
 if __name__ == "__main__":
     cli()
@@ -8,6 +8,8 @@
 """
 import re
 import fnmatch
+import collections
+from collections.abc import Mapping
 from logging import getLogger
 import jsonpointer
 import jsonpath
@@ -211,6 +213,132 @@ def compare_eval(a, b):
     return eval(b, {}, {"x": a})
 
 
+def lookup_items(d, k, key_fn, swap=False):
+    """
+    items of d whose key matches k (exact keys are looked up directly)
+
+    >>> lookup_items({"a": 1, "b": 2}, "b", EQ)
+    [('b', 2)]
+    >>> list(lookup_items({"a": 1, "ab": 2}, "a", IN1))
+    [('a', 1)]
+    >>> list(lookup_items({"a": 1, "ab": 2}, "a", IN1, True))
+    [('a', 1), ('ab', 2)]
+    """
+    if key_fn is EQ:
+        return [(k, d[k])] if k in d else []
+    if swap:
+        return filter(lambda f: key_fn(k, f[0]), d.items())
+    return filter(lambda f: key_fn(f[0], k), d.items())
+
+
+def levenshtein(a, b, limit=None):
+    """
+    >>> levenshtein("kitten", "sitting")
+    3
+    >>> levenshtein("", "abc")
+    3
+    >>> levenshtein("kitten", "sitting", 1)
+    2
+    >>> levenshtein("abcdef", "a", 2)
+    3
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if limit is not None and min(cur) > limit:
+            return limit + 1
+        prev = cur
+    if limit is not None:
+        return min(prev[-1], limit + 1)
+    return prev[-1]
+
+
+def trigrams(s):
+    """
+    >>> sorted(trigrams("abc"))
+    ['  a', ' ab', 'abc', 'bc ']
+    """
+    s = "  " + s + " "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def trigram_similarity(a, b):
+    """
+    >>> trigram_similarity("abc", "abc")
+    1.0
+    >>> trigram_similarity("abc", "xyz")
+    0.0
+    >>> round(trigram_similarity("host01", "host02"), 2)
+    0.56
+    """
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb)
+
+
+def parse_fuzzy(b):
+    """
+    >>> parse_fuzzy("host01~2")
+    ('host01', 2)
+    >>> parse_fuzzy("host01")
+    ('host01', 1)
+    >>> parse_fuzzy("a~b")
+    ('a~b', 1)
+    """
+    word, sep, k = b.rpartition("~")
+    if sep and k.isdigit():
+        return word, int(k)
+    return b, 1
+
+
+def fuzzy_rank(word, target, distance=None, similarity=None):
+    """
+    edit distance (default limit 1), or negated trigram similarity when
+    similarity is given; None when word is not near target
+
+    >>> fuzzy_rank("host01", "host02")
+    1
+    >>> fuzzy_rank("host01", "hots01") is None
+    True
+    >>> fuzzy_rank("host01", "host02", similarity=0.5)
+    -0.5555555555555556
+    >>> fuzzy_rank("host01", "host02", 0, similarity=0.5) is None
+    True
+    """
+    if similarity is None:
+        k = 1 if distance is None else distance
+        d = levenshtein(word, target, k)
+        return d if d <= k else None
+    sim = trigram_similarity(word, target)
+    if sim < similarity:
+        return None
+    if distance is not None and levenshtein(word, target, distance) > distance:
+        return None
+    return -sim
+
+
+def compare_fuzzy(a, b):
+    """
+    >>> compare_fuzzy("host01", "host02")
+    True
+    >>> compare_fuzzy("host01", "hots01")
+    False
+    >>> compare_fuzzy("host01", "hots01~2")
+    True
+    >>> compare_fuzzy(1, "1")
+    False
+    """
+    if isinstance(a, str) and isinstance(b, str):
+        word, k = parse_fuzzy(b)
+        return levenshtein(a, word, k) <= k
+    return EQ(a, b)
+
+
 def compare_subset(a, b, key_fn=EQ, val_fn=EQ):
     """
     >>> compare_subset({"a":"b", "c":{"d":"e"}}, {"a":"b"})
@@ -234,7 +362,7 @@ def compare_subset(a, b, key_fn=EQ, val_fn=EQ):
     elif isinstance(b, dict) and isinstance(a, dict):
         for kb, vb in b.items():
             flag = False
-            for ka, va in filter(lambda f: key_fn(f[0], kb), a.items()):
+            for ka, va in lookup_items(a, kb, key_fn):
                 if compare_subset(va, vb, key_fn, val_fn):
                     flag = True
                     break
@@ -271,7 +399,7 @@ def compare_superset(a, b, key_fn=EQ, val_fn=EQ):
     elif isinstance(a, dict) and isinstance(b, dict):
         for ka, va in a.items():
             flag = False
-            for kb, vb in filter(lambda f: key_fn(ka, f[0]), b.items()):
+            for kb, vb in lookup_items(b, ka, key_fn, True):
                 if compare_superset(va, vb, key_fn, val_fn):
                     flag = True
                     break
@@ -293,6 +421,37 @@ def compare_set(a, b, key_fn=EQ, val_fn=EQ):
     return compare_subset(a, b, key_fn, val_fn) and compare_superset(a, b, key_fn, val_fn)
 
 
+compare_mode = {
+    "set": compare_set,
+    "sub": compare_subset,
+    "super": compare_superset,
+}
+
+# relative cost of a single call, used by the query planner
+compare_cost = {
+    EQ: 1,
+    IS: 1,
+    IN1: 2,
+    IN2: 2,
+    compare_range: 3,
+    compare_fnmatch: 4,
+    compare_regexp: 5,
+    compare_regexp_substr: 5,
+    compare_fuzzy: 6,
+    compare_eval: 20,
+}
+
+
+def fn_cost(fn):
+    """
+    >>> fn_cost(EQ) < fn_cost(compare_regexp) < fn_cost(compare_eval)
+    True
+    >>> fn_cost(lambda a, b: True) == fn_cost(compare_eval)
+    True
+    """
+    return compare_cost.get(fn, max(compare_cost.values()))
+
+
 class JsonFind:
 
     @classmethod
@@ -309,8 +468,128 @@ class JsonFind:
         >>> class A: hello="world"
         >>> list(filter(lambda f: not f[0].startswith("_"), JsonFind.get_children_attr(A)))
         [('hello', 'world')]
+        >>> class B:
+        ...     __slots__ = ("x", "y")
+        >>> b = B()
+        >>> b.x = {"c": [1]}
+        >>> list(JsonFind.get_children_attr(b))
+        [('x', {'c': [1]})]
+        >>> list(JsonFind.get_children_attr(b.x["c"]))
+        [(0, 1)]
+        """
+        # only real containers are walked into; other sequences (range,
+        # lazy __getitem__) may create a new object on every access
+        if isinstance(obj, dict):
+            yield from obj.items()
+            return
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            yield from enumerate(obj)
+            return
+        d = getattr(obj, "__dict__", None)
+        if isinstance(d, Mapping):
+            yield from d.items()
+        for name in cls.get_slot_names(type(obj)):
+            try:
+                yield name, getattr(obj, name)
+            except AttributeError:
+                # slot declared but never assigned
+                pass
+
+    @classmethod
+    def get_slot_names(cls, klass):
+        """
+        >>> class A: __slots__ = ("a", "__weakref__")
+        >>> class B(A): __slots__ = "b"
+        >>> JsonFind.get_slot_names(B)
+        ['b', 'a']
+        >>> class _P: __slots__ = ("__secret", "__x__")
+        >>> JsonFind.get_slot_names(_P)
+        ['_P__secret', '__x__']
         """
-        return obj.__dict__.items()
+        res = []
+        for k in getattr(klass, "__mro__", ()):
+            slots = k.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = [slots]
+            prefix = k.__name__.lstrip("_")
+            for name in slots:
+                if name.startswith("__") and not name.endswith("__") and prefix:
+                    # private names are mangled like attribute access in the class body
+                    name = "_{}{}".format(prefix, name)
+                if name not in ("__dict__", "__weakref__") and name not in res:
+                    res.append(name)
+        return res
+
+    @classmethod
+    def attr_all_paths(cls, obj, match, max_depth=None, max_nodes=None):
+        """
+        all paths from obj to objects that satisfy match(), see AttrGraph
+
+        >>> a = {"x": 1}
+        >>> a["self"] = a
+        >>> JsonFind.attr_all_paths({"p": a, "q": a}, lambda f: f == 1)
+        [['p', 'x'], ['q', 'x']]
+        >>> x = {"v": "T"}
+        >>> JsonFind.attr_all_paths({"a": x, "b": {"c": x}}, lambda f: f == "T", 2)
+        [['a', 'v']]
+        >>> JsonFind.attr_all_paths({"b": {"c": x}, "a": x}, lambda f: f == "T", 2)
+        [['a', 'v']]
+        """
+        return AttrGraph(obj, match, max_depth, max_nodes).all_paths()
+
+    @classmethod
+    def attr_shortest_paths(cls, obj, match, max_depth=None, max_nodes=None, unique=False):
+        """
+        shortest path from obj to each reference to an object that satisfies match()
+
+        breadth first, each object is walked once. every holder of a
+        match is reported, or with unique=True only the first (shortest)
+        path to each matched object.
+
+        >>> a = {"x": 1}
+        >>> list(JsonFind.attr_shortest_paths({"p": {"q": a}, "r": a}, lambda f: f is a))
+        [['r'], ['p', 'q']]
+        >>> list(JsonFind.attr_shortest_paths({"p": {"q": a}, "r": a}, lambda f: f is a, unique=True))
+        [['r']]
+        """
+        def path(ent, k):
+            res = [k]
+            while ent.parent is not None:
+                res.append(ent.key)
+                ent = ent.parent
+            return res[::-1]
+
+        if match(obj):
+            yield []
+            return
+        queue = collections.deque([AttrEntry(obj, None, None, 0)])
+        # id -> object; holding the objects keeps their ids from being reused
+        seen = {id(obj): obj}
+        visited = 0
+        while queue:
+            ent = queue.popleft()
+            if max_depth is not None and ent.depth >= max_depth:
+                continue
+            if max_nodes is not None and visited >= max_nodes:
+                log.warning("node budget exceeded: %s", max_nodes)
+                return
+            visited += 1
+            for k, v in cls.get_children_attr(ent.obj):
+                if match(v):
+                    if unique:
+                        if id(v) in seen:
+                            continue
+                        seen[id(v)] = v
+                    yield path(ent, k)
+                elif id(v) not in seen:
+                    seen[id(v)] = v
+                    queue.append(AttrEntry(v, ent, k, ent.depth + 1))
+
+    @classmethod
+    def filter_attr(cls, obj, match, shortest=False, max_depth=None, max_nodes=None, unique=False):
+        if shortest:
+            return cls.attr_shortest_paths(obj, match, max_depth, max_nodes, unique)
+        return iter(cls.attr_all_paths(obj, match, max_depth, max_nodes))
 
     @classmethod
     def issubset(cls, obj, target):
@@ -353,60 +632,182 @@ class JsonFind:
         return
 
     @classmethod
-    def filter_compare(cls, obj, target, key_fn=IS, val_fn=IS):
-        if compare_set(obj, target, key_fn, val_fn):
-            log.debug("found %s %s", obj, target)
+    def kind_of(cls, obj):
+        """
+        >>> [JsonFind.kind_of(x) for x in ({}, [], (), "a", 1, None)]
+        ['object', 'array', 'array', 'scalar', 'scalar', 'scalar']
+        """
+        if isinstance(obj, dict):
+            return "object"
+        elif isinstance(obj, (tuple, list)):
+            return "array"
+        return "scalar"
+
+    @classmethod
+    def count_leaves(cls, obj):
+        """
+        >>> JsonFind.count_leaves({"a": [1, 2], "b": {"c": "d"}, "e": {}})
+        3
+        """
+        if cls.kind_of(obj) == "scalar":
+            return 1
+        return sum(cls.count_leaves(v) for _, v in cls.get_children(obj))
+
+    @classmethod
+    def node_stats(cls, obj):
+        """
+        number of nodes of each kind
+
+        >>> sorted(JsonFind.node_stats({"a": [1, 2], "b": {"c": "d"}}).items())
+        [('array', 1), ('object', 2), ('scalar', 3)]
+        """
+        res = collections.Counter()
+        stack = [obj]
+        while stack:
+            o = stack.pop()
+            res[cls.kind_of(o)] += 1
+            stack.extend(v for _, v in cls.get_children(o))
+        return res
+
+    @classmethod
+    def plan(cls, target, key_fn=IS, val_fn=IS, mode="set", index=None, stats=None):
+        """
+        choose how to evaluate filter_compare* for target
+
+        >>> JsonFind.plan({"a": {"b": 1, "d": 2}, "c": 2}, EQ, EQ).explain()["order"]
+        ['c', 'a']
+        >>> idx = JsonIndex({"x": {"a": 1, "b": 2}, "y": {"a": 1}})
+        >>> p = JsonFind.plan({"a": 1, "b": 2}, EQ, EQ, "sub", idx)
+        >>> p.strategy, p.estimated
+        ('index', 1)
+        >>> p = JsonFind.plan({"a": 1}, EQ, compare_regexp, "sub", idx)
+        >>> p.strategy, p.kind, p.estimated
+        ('scan', None, 6)
+        >>> JsonFind.plan({"a": 1}, EQ, EQ, "sub").indexable
+        True
+        >>> JsonFind.plan({"a": 1}, EQ, EQ, "sub", stats=JsonFind.node_stats(idx.nodes[0])).estimated
+        3
+        """
+        if stats is None and index is not None:
+            stats = index.kinds
+        res = QueryPlan(mode, target, key_fn, val_fn, index, stats)
+        exact_key = key_fn in (EQ, IS)
+        # with exact values, only nodes of the same kind as target can match
+        if val_fn in (EQ, IS):
+            res.kind = cls.kind_of(target)
+        if isinstance(target, dict) and len(target) > 1:
+            if exact_key and fn_cost(val_fn) >= fn_cost(compare_regexp):
+                # missing keys reject containers without calling val_fn
+                res.order = "container-first"
+                res.target = dict(sorted(target.items(), key=lambda f: -cls.count_leaves(f[1])))
+            else:
+                res.order = "leaf-first"
+                res.target = dict(sorted(target.items(), key=lambda f: cls.count_leaves(f[1])))
+        lookup = None
+        if exact_key and res.kind == "object" and mode != "super" and target:
+            lookup = "key"
+        elif res.kind == "scalar":
+            try:
+                hash(target)
+                lookup = "value"
+            except TypeError:
+                pass
+        elif val_fn is compare_fuzzy and isinstance(target, str):
+            lookup = "fuzzy"
+        # building an index costs about one scan: callers build it only when it pays
+        res.indexable = lookup is not None
+        if index is None:
+            res.estimated = res.scan_estimate()
+            return res
+        if lookup == "key":
+            # every target key must be present (a is b implies a == b)
+            postings = sorted((index.by_key.get(k, []) for k in target), key=len)
+            cand = set(postings[0])
+            for p in postings[1:]:
+                cand &= set(p)
+            res.strategy = "index"
+            res.candidates = sorted(cand)
+        elif lookup == "value":
+            res.candidates = list(index.by_value.get(target, []))
+            res.strategy = "index"
+        elif lookup == "fuzzy":
+            # a scan compares every node; the index is built over each distinct string once
+            fuzzy = index.fuzzy_index.get("values")
+            build = 0 if fuzzy is not None else len(index.by_value)
+            words = len(fuzzy.words) if fuzzy is not None else len(index.by_value)
+            if build + words * fn_cost(val_fn) < len(index.nodes) * fn_cost(val_fn):
+                word, k = parse_fuzzy(target)
+                res.candidates = sorted(pos for _, w in index.fuzzy().search(word, k) for pos in index.by_value[w])
+                res.strategy = "index"
+        if res.candidates is not None:
+            res.estimated = len(res.candidates)
+        else:
+            res.estimated = res.scan_estimate()
+        return res
+
+    @classmethod
+    def filter_plan(cls, obj, plan):
+        cmpfn = compare_mode[plan.mode]
+
+        def check(node):
+            plan.actual += 1
+            if cmpfn(node, plan.target, plan.key_fn, plan.val_fn):
+                log.debug("found %s %s", node, plan.target)
+                plan.matched += 1
+                return True
+            log.debug("not-found %s %s", node, plan.target)
+            return False
+
+        if plan.candidates is not None:
+            index = plan.index
+            end = 0
+            for pos in plan.candidates:
+                # do not report matches inside a match, same as scan
+                if pos < end:
+                    continue
+                if check(index.nodes[pos]):
+                    end = index.ends[pos]
+                    yield index.path(pos)
+            return
+        kind = plan.kind
+        if (kind is None or cls.kind_of(obj) == kind) and check(obj):
             yield []
             return
-        log.debug("not-found %s %s", obj, target)
-        for k, v in cls.get_children(obj):
-            for chld in cls.filter_compare(v, target, key_fn, val_fn):
-                yield [k, *chld]
-        return
+        path = []
+        stack = [iter(cls.get_children(obj))]
+        while stack:
+            for k, v in stack[-1]:
+                if (kind is None or cls.kind_of(v) == kind) and check(v):
+                    yield [*path, k]
+                    continue
+                if isinstance(v, (dict, tuple, list)):
+                    path.append(k)
+                    stack.append(iter(cls.get_children(v)))
+                    break
+            else:
+                stack.pop()
+                if path:
+                    path.pop()
+
+    @classmethod
+    def filter_compare(cls, obj, target, key_fn=IS, val_fn=IS):
+        return cls.filter_plan(obj, cls.plan(target, key_fn, val_fn, "set"))
 
     @classmethod
     def filter_compare_subset(cls, obj, target, key_fn=IS, val_fn=IS):
-        if compare_subset(obj, target, key_fn, val_fn):
-            log.debug("found %s %s", obj, target)
-            yield []
-            return
-        log.debug("not-found %s %s", obj, target)
-        for k, v in cls.get_children(obj):
-            for chld in cls.filter_compare_subset(v, target, key_fn, val_fn):
-                yield [k, *chld]
-        return
+        return cls.filter_plan(obj, cls.plan(target, key_fn, val_fn, "sub"))
 
     @classmethod
     def filter_compare_superset(cls, obj, target, key_fn=IS, val_fn=IS):
-        if compare_superset(obj, target, key_fn, val_fn):
-            log.debug("found %s %s", obj, target)
-            yield []
-            return
-        log.debug("not-found %s %s", obj, target)
-        for k, v in cls.get_children(obj):
-            for chld in cls.filter_compare_superset(v, target, key_fn, val_fn):
-                yield [k, *chld]
-        return
+        return cls.filter_plan(obj, cls.plan(target, key_fn, val_fn, "super"))
 
     @classmethod
-    def filter_attr_eq(cls, obj, target):
-        if obj == target:
-            yield []
-            return
-        for k, v in cls.get_children_attr(obj):
-            for chld in cls.filter_attr_eq(v, target):
-                yield [k, *chld]
-        return
+    def filter_attr_eq(cls, obj, target, shortest=False, max_depth=None, max_nodes=None):
+        return cls.filter_attr(obj, lambda f: f == target, shortest, max_depth, max_nodes)
 
     @classmethod
-    def filter_attr_is(cls, obj, target):
-        if obj is target:
-            yield []
-            return
-        for k, v in cls.get_children_attr(obj):
-            for chld in cls.filter_attr_is(v, target):
-                yield [k, *chld]
-        return
+    def filter_attr_is(cls, obj, target, shortest=False, max_depth=None, max_nodes=None):
+        return cls.filter_attr(obj, lambda f: f is target, shortest, max_depth, max_nodes, True)
 
     @classmethod
     def filter_key(cls, obj, target, prev=[]):
@@ -418,6 +819,78 @@ class JsonFind:
                 yield [k, *chld]
         return
 
+    @classmethod
+    def filter_fuzzy(cls, obj, target, distance=None, similarity=None, keys=True, values=True, index=None):
+        """
+        string values (and keys) near target, best match first
+
+        without an index the document is scanned once, comparing each
+        distinct string once.
+
+        >>> obj = {"a": "host01", "b": ["host02", "db01"], "hots01": 1}
+        >>> list(JsonFind.filter_fuzzy(obj, "host01"))
+        [['a'], ['b', 0]]
+        >>> list(JsonFind.filter_fuzzy(obj, "host01", 2))
+        [['a'], ['b', 0], ['hots01']]
+        >>> list(JsonFind.filter_fuzzy(obj, "host01", 2, keys=False))
+        [['a'], ['b', 0]]
+        >>> list(JsonFind.filter_fuzzy(obj, "host", similarity=0.4))
+        [['a'], ['b', 0]]
+        >>> list(JsonFind.filter_fuzzy(obj, "host01", 2, index=JsonIndex(obj)))
+        [['a'], ['b', 0], ['hots01']]
+        """
+        res = []  # (rank, document order, path)
+        if index is not None:
+            if values:
+                for rank, word in index.fuzzy("values").search(target, distance, similarity):
+                    res.extend((rank, pos, None) for pos in index.by_value[word])
+            if keys:
+                members = index.members()
+                for rank, word in index.fuzzy("keys").search(target, distance, similarity):
+                    res.extend((rank, pos, None) for pos in members[word])
+        else:
+            ranks = {}
+
+            def rank_of(word):
+                if word not in ranks:
+                    ranks[word] = fuzzy_rank(word, target, distance, similarity)
+                return ranks[word]
+
+            if values and isinstance(obj, str) and rank_of(obj) is not None:
+                res.append((rank_of(obj), 0, []))
+            order = 0
+            path = []
+            stack = [iter(cls.get_children(obj))]
+            while stack:
+                for k, v in stack[-1]:
+                    order += 1
+                    ranked = []
+                    if keys and isinstance(k, str) and rank_of(k) is not None:
+                        ranked.append(rank_of(k))
+                    if values and isinstance(v, str) and rank_of(v) is not None:
+                        ranked.append(rank_of(v))
+                    if ranked:
+                        res.append((min(ranked), order, [*path, k]))
+                    if isinstance(v, (dict, tuple, list)):
+                        path.append(k)
+                        stack.append(iter(cls.get_children(v)))
+                        break
+                else:
+                    stack.pop()
+                    if path:
+                        path.pop()
+        res.sort(key=lambda f: f[:2])
+        seen = set()
+        for rank, order, path in res:
+            # a member may match by both key and value
+            if order in seen:
+                continue
+            seen.add(order)
+            if path is None:
+                path = index.path(order)
+            log.debug("fuzzy %s %s", rank, path)
+            yield path
+
     @classmethod
     def find_eq(cls, obj, target):
         return next(cls.filter_eq(obj, target), None)
@@ -427,12 +900,12 @@ class JsonFind:
         return next(cls.filter_is(obj, target), None)
 
     @classmethod
-    def find_attr_eq(cls, obj, target):
-        return next(cls.filter_attr_eq(obj, target), None)
+    def find_attr_eq(cls, obj, target, max_depth=None, max_nodes=None):
+        return next(cls.filter_attr_eq(obj, target, True, max_depth, max_nodes), None)
 
     @classmethod
-    def find_attr_is(cls, obj, target):
-        return next(cls.filter_attr_is(obj, target), None)
+    def find_attr_is(cls, obj, target, max_depth=None, max_nodes=None):
+        return next(cls.filter_attr_is(obj, target, True, max_depth, max_nodes), None)
 
     @classmethod
     def find_subset(cls, obj, target):
@@ -487,6 +960,378 @@ class JsonFind:
         return None
 
 
+class AttrNode:
+    __slots__ = ("obj", "match", "dist", "edges", "back", "comp", "reach", "exit", "entry", "paths")
+
+    def __init__(self, obj, match, dist):
+        self.obj = obj      # keeps the object alive, so that its id is not reused
+        self.match = match
+        self.dist = dist    # length of the shortest path from the root
+        self.edges = []     # (key, id of child)
+        self.back = []      # ids of parents in the same component
+        self.comp = None    # number of the strongly connected component
+        self.reach = False  # a match can be reached from here
+        self.exit = False   # has an edge out of its component towards a match
+        self.entry = False  # has an edge into it from another component
+        self.paths = None   # paths to matches, for entries
+
+
+AttrEntry = collections.namedtuple("AttrEntry", ["obj", "parent", "key", "depth"])
+AttrFrame = collections.namedtuple("AttrFrame", ["nid", "edges", "alive"])
+
+
+class AttrGraph:
+    """
+    objects reachable from obj through attributes, and the paths to
+    objects that satisfy match()
+
+    the objects are walked once, breadth first; matched objects are not
+    walked into. paths never pass through an object twice. they are
+    computed once per entry into a strongly connected component, so
+    shared sub-objects cost nothing extra; inside a cyclic component
+    only members that can still reach a match are walked.
+
+    >>> x = {}
+    >>> y = {"m": "T"}
+    >>> x["y"], y["x"] = y, x
+    >>> AttrGraph({"a": x, "b": y}, lambda f: f == "T").all_paths()
+    [['a', 'y', 'm'], ['b', 'm']]
+    >>> AttrGraph({"b": y, "a": x}, lambda f: f == "T").all_paths()
+    [['b', 'm'], ['a', 'y', 'm']]
+    """
+
+    def __init__(self, obj, match, max_depth=None, max_nodes=None):
+        self.max_depth = max_depth
+        self.root = id(obj)
+        self.nodes = {self.root: AttrNode(obj, match(obj), 0)}
+        queue = collections.deque([self.root])
+        walked = 0
+        while queue:
+            node = self.nodes[queue.popleft()]
+            if node.match or (max_depth is not None and node.dist >= max_depth):
+                continue
+            if max_nodes is not None and walked >= max_nodes:
+                log.warning("node budget exceeded: %s", max_nodes)
+                break
+            walked += 1
+            for k, v in JsonFind.get_children_attr(node.obj):
+                if id(v) not in self.nodes:
+                    self.nodes[id(v)] = AttrNode(v, match(v), node.dist + 1)
+                    queue.append(id(v))
+                node.edges.append((k, id(v)))
+        self.comps = self.components()
+        for comp in self.comps:
+            # components come sinks first, so children outside are done
+            for nid in comp:
+                node = self.nodes[nid]
+                for _, cid in node.edges:
+                    child = self.nodes[cid]
+                    if child.comp == node.comp:
+                        child.back.append(nid)
+                    else:
+                        child.entry = True
+                        node.exit = node.exit or child.reach
+            reach = any(self.nodes[nid].match or self.nodes[nid].exit for nid in comp)
+            for nid in comp:
+                self.nodes[nid].reach = reach
+
+    def components(self):
+        """strongly connected components (Tarjan), sinks first"""
+        index = {self.root: 0}
+        low = {self.root: 0}
+        stack = [self.root]
+        onstack = {self.root}
+        comps = []
+        work = [(self.root, iter(self.nodes[self.root].edges))]
+        while work:
+            nid, edges = work[-1]
+            for _, cid in edges:
+                if cid not in index:
+                    index[cid] = low[cid] = len(index)
+                    stack.append(cid)
+                    onstack.add(cid)
+                    work.append((cid, iter(self.nodes[cid].edges)))
+                    break
+                if cid in onstack:
+                    low[nid] = min(low[nid], index[cid])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[nid])
+                if low[nid] == index[nid]:
+                    comp = []
+                    while not comp or comp[-1] != nid:
+                        comp.append(stack.pop())
+                        onstack.discard(comp[-1])
+                        self.nodes[comp[-1]].comp = len(comps)
+                    comps.append(comp)
+        return comps
+
+    def remaining(self, nid):
+        if self.max_depth is None:
+            return None
+        return self.max_depth - self.nodes[nid].dist
+
+    def alive(self, comp, onpath):
+        """members of comp that reach an exit without passing through onpath"""
+        todo = [nid for nid in self.comps[comp] if self.nodes[nid].exit and nid not in onpath]
+        res = set(todo)
+        while todo:
+            for nid in self.nodes[todo.pop()].back:
+                if nid not in res and nid not in onpath:
+                    res.add(nid)
+                    todo.append(nid)
+        return res
+
+    def entry_paths(self, nid, rem):
+        """paths from an entry, with at most rem steps"""
+        node = self.nodes[nid]
+        if node.match:
+            return [[]]
+        if rem is not None and rem < self.remaining(nid):
+            return [x for x in node.paths if len(x) <= rem]
+        return node.paths
+
+    def comp_paths(self, entry):
+        """paths from entry through its component, then through other entries"""
+        res = []
+        rem = self.remaining(entry)
+        path = []
+        onpath = {entry}
+        frames = [AttrFrame(entry, iter(self.nodes[entry].edges), self.alive(self.nodes[entry].comp, onpath))]
+        while frames:
+            frame = frames[-1]
+            comp = self.nodes[frame.nid].comp
+            steps = len(path) + 1
+            for k, cid in frame.edges:
+                child = self.nodes[cid]
+                if not child.reach or (rem is not None and steps > rem):
+                    continue
+                if child.match:
+                    res.append([*path, k])
+                elif child.comp != comp:
+                    left = None if rem is None else rem - steps
+                    res.extend([*path, k, *x] for x in self.entry_paths(cid, left))
+                elif cid in frame.alive:
+                    path.append(k)
+                    onpath.add(cid)
+                    frames.append(AttrFrame(cid, iter(child.edges), self.alive(comp, onpath)))
+                    break
+            else:
+                frames.pop()
+                if frames:
+                    path.pop()
+                    onpath.discard(frame.nid)
+        return res
+
+    def all_paths(self):
+        for comp in self.comps:
+            for nid in comp:
+                node = self.nodes[nid]
+                if (node.entry or nid == self.root) and node.reach and not node.match:
+                    node.paths = self.comp_paths(nid)
+                elif node.entry or nid == self.root:
+                    node.paths = []
+        return self.entry_paths(self.root, None)
+
+
+class JsonIndex:
+    """
+    document statistics and lookup tables for the query planner
+
+    >>> idx = JsonIndex({"a": {"b": 1}, "c": [1, 2]})
+    >>> len(idx.nodes), idx.kinds["scalar"], idx.by_key["b"]
+    (6, 3, [1])
+    >>> [idx.path(i) for i in idx.by_value[1]]
+    [['a', 'b'], ['c', 0]]
+    >>> idx.ends
+    [6, 3, 3, 6, 5, 6]
+    """
+
+    def __init__(self, obj):
+        # per node, in document order
+        self.nodes = []
+        self.parents = []  # position of the parent, -1 for the root
+        self.keys = []     # key in the parent
+        self.kinds = collections.Counter()
+        self.by_key = {}
+        self.by_value = {}
+        stack = [(-1, None, obj)]
+        while stack:
+            parent, key, node = stack.pop()
+            pos = len(self.nodes)
+            self.nodes.append(node)
+            self.parents.append(parent)
+            self.keys.append(key)
+            kind = JsonFind.kind_of(node)
+            self.kinds[kind] += 1
+            if kind == "object":
+                for k in node:
+                    self.by_key.setdefault(k, []).append(pos)
+            elif kind == "scalar":
+                try:
+                    self.by_value.setdefault(node, []).append(pos)
+                except TypeError:
+                    pass
+            stack.extend((pos, k, v) for k, v in reversed(list(JsonFind.get_children(node))))
+        # position after the last descendant
+        self.ends = list(range(1, len(self.nodes) + 1))
+        for pos in range(len(self.nodes) - 1, 0, -1):
+            parent = self.parents[pos]
+            if self.ends[parent] < self.ends[pos]:
+                self.ends[parent] = self.ends[pos]
+        self.by_member = None
+        self.fuzzy_index = {}
+
+    def path(self, pos):
+        res = []
+        while self.parents[pos] >= 0:
+            res.append(self.keys[pos])
+            pos = self.parents[pos]
+        return res[::-1]
+
+    def members(self):
+        """positions of object members by key"""
+        if self.by_member is None:
+            self.by_member = {}
+            for pos, k in enumerate(self.keys):
+                if isinstance(k, str):
+                    self.by_member.setdefault(k, []).append(pos)
+        return self.by_member
+
+    def fuzzy(self, what="values"):
+        """FuzzyIndex over the string values or keys, built on first use"""
+        if what not in self.fuzzy_index:
+            words = self.by_value if what == "values" else self.members()
+            self.fuzzy_index[what] = FuzzyIndex(w for w in words if isinstance(w, str))
+        return self.fuzzy_index[what]
+
+
+class FuzzyIndex:
+    """
+    trigram postings over a set of strings, for edit distance and
+    trigram similarity lookup
+
+    for edit distance, words that share too few trigrams with the query
+    (q-gram lemma: an edit breaks at most 3 of them) are skipped
+    before the bounded levenshtein is computed.
+
+    >>> fi = FuzzyIndex(["host01", "host02", "db01"])
+    >>> fi.search("host00")
+    [(1, 'host01'), (1, 'host02')]
+    >>> fi.search("host00", 2)
+    [(1, 'host01'), (1, 'host02')]
+    >>> fi.search("db01", similarity=0.3)
+    [(-1.0, 'db01')]
+    >>> fi.search("d", 3)
+    [(3, 'db01')]
+    """
+
+    def __init__(self, words):
+        self.words = set(words)
+        self.grams = {}   # trigram -> [(word, count)]
+        self.gramlen = {}  # word -> number of distinct trigrams
+        self.by_len = {}
+        for w in self.words:
+            g = self.gram_counts(w)
+            self.gramlen[w] = len(g)
+            self.by_len.setdefault(len(w), []).append(w)
+            for t, n in g.items():
+                self.grams.setdefault(t, []).append((w, n))
+
+    @staticmethod
+    def gram_counts(s):
+        """trigrams of s, padded as in trigrams(), with multiplicity"""
+        s = "  " + s + " "
+        return collections.Counter(s[i:i + 3] for i in range(len(s) - 2))
+
+    def shared(self, grams):
+        """word -> (shared trigrams with multiplicity, distinct shared trigrams)"""
+        res = {}
+        for t, n in grams.items():
+            for w, c in self.grams.get(t, ()):
+                total, distinct = res.get(w, (0, 0))
+                res[w] = (total + min(n, c), distinct + 1)
+        return res
+
+    def search(self, word, distance=None, similarity=None):
+        """(rank, word) sorted best first, see fuzzy_rank"""
+        grams = self.gram_counts(word)
+        shared = self.shared(grams)
+        res = []
+        if similarity is None:
+            k = 1 if distance is None else distance
+            cand = set()
+            for n in range(max(0, len(word) - k), len(word) + k + 1):
+                # a string of n characters has n + 1 trigrams
+                if max(n, len(word)) + 1 - 3 * k <= 0:
+                    cand.update(self.by_len.get(n, ()))
+            for w, (total, _) in shared.items():
+                if abs(len(w) - len(word)) <= k and total >= max(len(w), len(word)) + 1 - 3 * k:
+                    cand.add(w)
+            for w in cand:
+                d = levenshtein(word, w, k)
+                if d <= k:
+                    res.append((d, w))
+            return sorted(res)
+        cand = self.words if similarity <= 0 else shared
+        for w in cand:
+            n = shared.get(w, (0, 0))[1]
+            sim = n / (len(grams) + self.gramlen[w] - n)
+            if sim < similarity:
+                continue
+            if distance is not None and levenshtein(word, w, distance) > distance:
+                continue
+            res.append((-sim, w))
+        return sorted(res)
+
+
+class QueryPlan:
+    def __init__(self, mode, target, key_fn, val_fn, index=None, stats=None):
+        self.mode = mode
+        self.target = target
+        self.key_fn = key_fn
+        self.val_fn = val_fn
+        self.index = index
+        self.stats = stats
+        self.strategy = "scan"
+        self.kind = None
+        self.order = None
+        self.candidates = None
+        self.indexable = False
+        self.estimated = None
+        self.actual = 0
+        self.matched = 0
+
+    def total(self):
+        return sum(self.stats.values()) if self.stats is not None else None
+
+    def scan_estimate(self):
+        """nodes a scan compares, from node counts by kind"""
+        if self.stats is None:
+            return None
+        if self.kind is not None:
+            return self.stats[self.kind]
+        return self.total()
+
+    def explain(self):
+        return {
+            "mode": self.mode,
+            "strategy": self.strategy,
+            "indexable": self.indexable,
+            "kind": self.kind,
+            "key": getattr(self.key_fn, "__name__", str(self.key_fn)),
+            "value": getattr(self.val_fn, "__name__", str(self.val_fn)),
+            "order": list(self.target.keys()) if self.order is not None else None,
+            "order_by": self.order,
+            "total": self.total(),
+            "estimated": self.estimated,
+            "actual": self.actual,
+            "matched": self.matched,
+        }
+
+
 format_list = [x.split("_", 1)[-1]
                for x in filter(lambda f: f.startswith("to_"), dir(JsonFind))]
 find_format_list = [*format_list]
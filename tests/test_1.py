@@ -1,5 +1,7 @@
 import unittest
-from jsonfind import JsonFind, format_list, find_format_list
+import collections.abc
+from jsonfind import JsonFind, JsonIndex, format_list, find_format_list, EQ, IS, compare_regexp, compare_fuzzy
+from jsonfind import FuzzyIndex, fuzzy_rank
 
 
 class TestJsonFind1(unittest.TestCase):
@@ -45,3 +47,283 @@ class TestJsonFind1(unittest.TestCase):
         self.assertEquals(JsonFind.find_key(obj, ["d"]), ["c", "d"])
         self.assertEquals(JsonFind.find_key(obj, ["c", "d"]), ["c", "d"])
         self.assertIsNone(JsonFind.find_key(obj, ["f", "d"]))
+
+
+class Node:
+    def __init__(self, name, *children):
+        self.name = name
+        self.children = list(children)
+
+
+class SlotNode:
+    __slots__ = ("name", "next")
+
+    def __init__(self, name, next=None):
+        self.name = name
+        self.next = next
+
+
+class TestJsonFindAttr(unittest.TestCase):
+    def test_cycle(self):
+        leaf = Node("leaf")
+        root = Node("root", leaf)
+        leaf.children.append(root)
+        self.assertEqual([["children", 0, "name"]], list(
+            JsonFind.filter_attr_eq(root, "leaf")))
+        self.assertEqual(["children", 0], JsonFind.find_attr_is(root, leaf))
+        self.assertIsNone(JsonFind.find_attr_eq(root, "none"))
+
+    def test_dag(self):
+        target = Node("target")
+        node = Node("n0", target)
+        for i in range(1, 30):
+            node = Node("n{}".format(i), node, node)
+        shortest = list(JsonFind.filter_attr_is(node, target, shortest=True))
+        self.assertEqual(1, len(shortest))
+        self.assertEqual(["children", 0] * 30, shortest[0])
+
+    def test_dag_all(self):
+        target = Node("target")
+        node = Node("n0", target)
+        for i in range(1, 12):
+            node = Node("n{}".format(i), node, node)
+        self.assertEqual(2 ** 11, len(list(JsonFind.filter_attr_is(node, target))))
+
+    def test_dag_backref(self):
+        top = Node("top")
+        node = Node("n0")
+        for i in range(1, 60):
+            node = Node("n{}".format(i), node, node)
+        top.children.append(node)
+        top.target = "target"
+        while node.children:
+            node.up = top
+            node = node.children[0]
+        node.up = top
+        self.assertEqual([["target"]], list(JsonFind.filter_attr_eq(top, "target")))
+        self.assertEqual([["children", 0] + ["children", 0] * 59 + ["name"]],
+                         list(JsonFind.filter_attr_eq(top, "n0", shortest=True)))
+
+    def test_cycle_order(self):
+        x = {}
+        y = {"m": "T"}
+        x["y"], y["x"] = y, x
+        self.assertEqual([["a", "y", "m"], ["b", "m"]], list(
+            JsonFind.filter_attr_eq({"a": x, "b": y}, "T")))
+        self.assertEqual([["b", "m"], ["a", "y", "m"]], list(
+            JsonFind.filter_attr_eq({"b": y, "a": x}, "T")))
+
+    def test_cycle_simple_paths(self):
+        nodes = [{"v": i} for i in range(5)]
+        for i, j in [(0, 1), (1, 2), (2, 0), (2, 3), (3, 1), (1, 4), (4, 0)]:
+            nodes[i]["n{}".format(j)] = nodes[j]
+
+        def walk(obj, path, onpath):
+            if obj == 3:
+                yield path
+            elif isinstance(obj, dict) and id(obj) not in onpath:
+                for k, v in obj.items():
+                    yield from walk(v, path + [k], onpath | {id(obj)})
+        for start in nodes:
+            self.assertEqual(sorted(walk(start, [], set())),
+                             sorted(JsonFind.filter_attr_eq(start, 3)))
+            self.assertEqual(sorted(x for x in walk(start, [], set()) if len(x) <= 4),
+                             sorted(JsonFind.filter_attr_eq(start, 3, max_depth=4)))
+
+    def test_depth_memo(self):
+        shared = Node("shared")
+        for obj in (Node("a", shared, Node("b", shared)), Node("a", Node("b", shared), shared)):
+            self.assertEqual(1, len(list(JsonFind.filter_attr_eq(obj, "shared", max_depth=3))), obj)
+            self.assertEqual(2, len(list(JsonFind.filter_attr_eq(obj, "shared", max_depth=5))), obj)
+
+    def test_shortest_holders(self):
+        obj = [Node("x"), Node("x")]
+        self.assertEqual([[0, "name"], [1, "name"]], list(JsonFind.filter_attr_eq(obj, "x", shortest=True)))
+        self.assertEqual([[0, "name"], [1, "name"]], list(JsonFind.filter_attr_eq(obj, "x")))
+        target = Node("t")
+        obj = [Node("a", target), target]
+        self.assertEqual([[1]], list(JsonFind.filter_attr_is(obj, target, shortest=True)))
+        self.assertEqual([[0, "children", 0], [1]], list(JsonFind.filter_attr_is(obj, target)))
+
+    def test_slots(self):
+        lst = SlotNode("c", {"k": ["x", "target"]})
+        obj = SlotNode("a", SlotNode("b", lst))
+        lst.next["back"] = obj
+        self.assertEqual([["next", "next", "next", "k", 1]], list(
+            JsonFind.filter_attr_eq(obj, "target")))
+        self.assertEqual("next.next.next.k[1]", JsonFind.to_jsonpath(
+            JsonFind.find_attr_eq(obj, "target")))
+
+    def test_private_slots(self):
+        class P:
+            __slots__ = ("__secret", "name")
+
+            def __init__(self):
+                self.__secret = "target"
+
+        self.assertEqual([["_P__secret"]], list(JsonFind.filter_attr_eq(P(), "target")))
+        self.assertEqual(["_P__secret"], JsonFind.find_attr_eq(P(), "target"))
+
+    def test_containers(self):
+        class Lazy(collections.abc.Sequence):
+            def __init__(self):
+                self.vals = ["a", "b"]
+
+            def __len__(self):
+                return 10 ** 7
+
+            def __getitem__(self, i):
+                if not 0 <= i < len(self):
+                    raise IndexError(i)
+                return {"v": i}
+
+        obj = Node("x")
+        obj.items = Lazy()
+        obj.nums = range(10 ** 7)
+        self.assertEqual([["items", "vals", 1]], list(JsonFind.filter_attr_eq(obj, "b")))
+        self.assertEqual([], list(JsonFind.filter_attr_eq(obj, 2)))
+        self.assertEqual([], list(JsonFind.filter_attr_eq(obj, 2, shortest=True)))
+
+    def test_budget(self):
+        obj = SlotNode("a", SlotNode("b", SlotNode("c")))
+        self.assertEqual([["next", "next", "name"]], list(
+            JsonFind.filter_attr_eq(obj, "c")))
+        self.assertEqual([], list(JsonFind.filter_attr_eq(obj, "c", max_depth=2)))
+        self.assertEqual([], list(JsonFind.filter_attr_eq(obj, "c", max_nodes=2)))
+        self.assertIsNone(JsonFind.find_attr_eq(obj, "c", max_depth=2))
+        self.assertIsNone(JsonFind.find_attr_eq(obj, "c", max_nodes=2))
+        self.assertEqual(["next", "next", "name"],
+                         JsonFind.find_attr_eq(obj, "c", max_depth=3, max_nodes=10))
+
+
+class TestJsonFindPlan(unittest.TestCase):
+    obj = {"a": {"b": 1, "c": {"b": 1, "d": 2}}, "e": [{"b": 1}, {"b": 2, "d": 2}], "f": 1}
+
+    def run_plan(self, target, key_fn, val_fn, mode, index=None):
+        plan = JsonFind.plan(target, key_fn, val_fn, mode, index)
+        return plan, list(JsonFind.filter_plan(self.obj, plan))
+
+    def test_index_same_as_scan(self):
+        index = JsonIndex(self.obj)
+        for target in ({"b": 1}, {"b": 2, "d": 2}, {"d": 2}, 1, 2, [{"b": 1}], {}, {"x": 1}):
+            for mode in ("set", "sub", "super"):
+                _, scan = self.run_plan(target, EQ, EQ, mode)
+                _, idx = self.run_plan(target, EQ, EQ, mode, index)
+                self.assertEqual(scan, idx, "{} {}".format(target, mode))
+
+    def test_index(self):
+        plan, res = self.run_plan({"b": 1}, EQ, EQ, "sub", JsonIndex(self.obj))
+        self.assertEqual([["a"], ["e", 0]], res)
+        self.assertEqual("index", plan.strategy)
+        self.assertTrue(plan.indexable)
+        self.assertEqual(4, plan.estimated)
+        self.assertEqual(3, plan.actual)
+        self.assertEqual(2, plan.matched)
+        plan, res = self.run_plan(1, EQ, EQ, "set", JsonIndex(self.obj))
+        self.assertEqual([["a", "b"], ["a", "c", "b"], ["e", 0, "b"], ["f"]], res)
+        self.assertEqual(4, plan.actual)
+
+    def test_scan(self):
+        plan, res = self.run_plan({"b": 1}, EQ, compare_regexp, "sub", JsonIndex(self.obj))
+        self.assertEqual("scan", plan.strategy)
+        self.assertIsNone(plan.kind)
+        self.assertEqual(13, plan.estimated)
+        self.assertFalse(plan.indexable)
+        plan, res = self.run_plan({"b": 2, "d": 2}, EQ, EQ, "super", JsonIndex(self.obj))
+        self.assertEqual("scan", plan.strategy)
+        self.assertFalse(plan.indexable)
+        self.assertEqual("object", plan.kind)
+        self.assertEqual(5, plan.estimated)
+        self.assertEqual([["e", 1]], res)
+
+    def test_no_index(self):
+        plan, res = self.run_plan({"b": 1}, EQ, EQ, "sub")
+        self.assertEqual("scan", plan.strategy)
+        self.assertTrue(plan.indexable)
+        self.assertIsNone(plan.estimated)
+        self.assertEqual([["a"], ["e", 0]], res)
+        self.assertEqual([[]], list(JsonFind.filter_compare(self.obj, self.obj, EQ, EQ)))
+
+    def test_explain_no_index(self):
+        stats = JsonFind.node_stats(self.obj)
+        self.assertEqual(JsonIndex(self.obj).kinds, stats)
+        plan = JsonFind.plan({"b": 1}, EQ, EQ, "sub", stats=stats)
+        res = list(JsonFind.filter_plan(self.obj, plan))
+        self.assertEqual([["a"], ["e", 0]], res)
+        explain = plan.explain()
+        self.assertEqual("scan", explain["strategy"])
+        self.assertEqual(13, explain["total"])
+        self.assertEqual(5, explain["estimated"])
+        self.assertEqual(4, explain["actual"])
+        self.assertEqual(2, explain["matched"])
+        plan = JsonFind.plan({"b": 1}, EQ, compare_regexp, "sub", stats=stats)
+        self.assertEqual(13, plan.explain()["estimated"])
+
+    def test_order(self):
+        target = {"a": {"b": 1, "c": 2}, "d": 3}
+        self.assertEqual("leaf-first", JsonFind.plan(target, EQ, EQ).order)
+        self.assertEqual(["d", "a"], list(JsonFind.plan(target, IS, IS).target))
+        plan = JsonFind.plan(target, EQ, compare_regexp)
+        self.assertEqual("container-first", plan.order)
+        self.assertEqual(["a", "d"], plan.explain()["order"])
+
+    def test_filter_compare(self):
+        self.assertEqual([["e", 1]], list(
+            JsonFind.filter_compare(self.obj, {"b": 2, "d": 2}, EQ, EQ)))
+        self.assertEqual([["a", "c"], ["e", 1]], list(
+            JsonFind.filter_compare_subset(self.obj, {"d": 2}, EQ, EQ)))
+        self.assertEqual([["a", "c"], ["e", 0]], list(
+            JsonFind.filter_compare_superset(self.obj, {"b": 1, "d": 2}, EQ, EQ)))
+
+
+class TestJsonFindFuzzy(unittest.TestCase):
+    obj = {"a": "host-01", "b": ["host-10", "db-01", "host-1"], "hots-01": {"c": "host-01"}}
+
+    def test_distance(self):
+        self.assertEqual([["a"], ["hots-01", "c"]], list(JsonFind.filter_fuzzy(self.obj, "host-01", 0)))
+        self.assertEqual([["a"], ["hots-01", "c"], ["b", 2]],
+                         list(JsonFind.filter_fuzzy(self.obj, "host-01")))
+        self.assertEqual([["a"], ["hots-01", "c"], ["b", 2], ["b", 0], ["hots-01"]],
+                         list(JsonFind.filter_fuzzy(self.obj, "host-01", 2)))
+        self.assertEqual([["hots-01"]],
+                         list(JsonFind.filter_fuzzy(self.obj, "hots-01", 0)))
+        self.assertEqual([], list(JsonFind.filter_fuzzy(self.obj, "hots-01", 0, keys=False)))
+        self.assertEqual([["x"]], list(JsonFind.filter_fuzzy({"x": "x"}, "x")))
+
+    def test_similarity(self):
+        res = list(JsonFind.filter_fuzzy(self.obj, "host-01", similarity=0.5))
+        self.assertEqual([["a"], ["hots-01", "c"]], res[:2])
+        self.assertNotIn(["b", 1], res)
+        self.assertEqual([["a"], ["hots-01", "c"]],
+                         list(JsonFind.filter_fuzzy(self.obj, "host-01", 0, similarity=0.1)))
+
+    def test_index_same_as_scan(self):
+        index = JsonIndex(self.obj)
+        for target in ("host-01", "hots-01", "db", "host-1", "nothing"):
+            for distance, similarity in ((None, None), (0, None), (2, None), (None, 0.3), (3, 0.5), (None, 0.0)):
+                for keys, values in ((True, True), (True, False), (False, True)):
+                    args = (target, distance, similarity, keys, values)
+                    self.assertEqual(list(JsonFind.filter_fuzzy(self.obj, *args)),
+                                     list(JsonFind.filter_fuzzy(self.obj, *args, index=index)), args)
+
+    def test_search_same_as_rank(self):
+        words = ["", "a", "ab", "ba", "aaa", "abab", "host-01", "host-10", "hots-01", "db-01", "xhost-01x"]
+        fuzzy = FuzzyIndex(words)
+        for target in ("", "a", "b", "aa", "abba", "host-01", "host", "db01"):
+            for distance in (0, 1, 2, 3, 5):
+                expected = sorted((fuzzy_rank(w, target, distance), w) for w in words
+                                  if fuzzy_rank(w, target, distance) is not None)
+                self.assertEqual(expected, fuzzy.search(target, distance), (target, distance))
+
+    def test_plan(self):
+        for target in ("host-01", "host-01~2", "db~2", "nothing"):
+            index_plan = JsonFind.plan(target, EQ, compare_fuzzy, "set", JsonIndex(self.obj))
+            scan_plan = JsonFind.plan(target, EQ, compare_fuzzy, "set")
+            self.assertEqual("index", index_plan.strategy)
+            self.assertEqual(list(JsonFind.filter_plan(self.obj, scan_plan)),
+                             list(JsonFind.filter_plan(self.obj, index_plan)), target)
+        distinct = ["word{}".format(i) for i in range(20)]
+        plan = JsonFind.plan("word1", EQ, compare_fuzzy, "set", JsonIndex(distinct))
+        self.assertEqual("scan", plan.strategy)
+        self.assertEqual([[i] for i in range(20)], list(JsonFind.filter_plan(distinct, plan)))
+        self.assertEqual(21, plan.actual)